@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 Víctor Molina García
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+""":class:`ImportBenchmark` class encapsulation."""
+
+import io
+import os
+import re
+import sys
+import json
+import glob
+import shutil
+import subprocess
+from . ZipArchive import ZipArchive
+from . TemporaryDirectory import TemporaryDirectory
+
+
+# Script run in a fresh interpreter to import the top-level modules.
+IMPORT_SCRIPT = """
+import os, sys, json, time
+try:
+    from importlib.machinery import EXTENSION_SUFFIXES
+except ImportError:
+    import imp
+    EXTENSION_SUFFIXES = [suffix for suffix, _, kind in imp.get_suffixes()
+                          if kind == imp.C_EXTENSION]
+timer = getattr(time, "perf_counter", time.time)
+path, names = sys.argv[1], sys.argv[2:]
+def state(filename):
+    try:
+        info = os.stat(filename)
+        return (info.st_size, info.st_mtime)
+    except OSError:
+        return None
+cached = {}
+for root, dirs, files in os.walk(path):
+    for name in files:
+        cached[os.path.join(root, name)] = state(os.path.join(root, name))
+sys.path.insert(0, path)
+start = timer()
+for name in names:
+    __import__(name)
+elapsed = timer() - start
+stats = {"time": elapsed, "bytecode": 0, "source": 0, "extension": 0,
+         "bytecode_size": 0}
+for module in list(sys.modules.values()):
+    filename = getattr(module, "__file__", None) or ""
+    if not filename.startswith(path):
+        continue
+    if filename.endswith(tuple(EXTENSION_SUFFIXES)):
+        stats["extension"] += 1
+        continue
+    if filename.endswith((".pyc", ".pyo")):
+        pycname = filename
+    elif filename.endswith(".py"):
+        pycname = getattr(module, "__cached__", None) or filename + "c"
+        if state(pycname) is None or state(pycname) != cached.get(pycname):
+            stats["source"] += 1
+            continue
+    else:
+        continue
+    if os.path.isfile(pycname):
+        stats["bytecode"] += 1
+        stats["bytecode_size"] += os.path.getsize(pycname)
+sys.stdout.write(json.dumps(stats))
+"""
+
+
+class ImportBenchmark(object):
+    """Measure the import time of the top-level modules of a wheel file.
+
+    The wheel is installed by extracting it into a temporary directory,
+    which is enough for the pure and platform-specific library files, and
+    its top-level modules are imported in fresh interpreter processes.
+    """
+
+    def __init__(self, path, python=None):
+
+        self.path = path
+        self.python = sys.executable if python is None else python
+        self.tmpdir = None
+
+    def install(self):
+        """Install the wheel contents into a temporary directory."""
+
+        if self.tmpdir is not None:
+            raise OSError("{0} is already installed".format(self.path))
+
+        self.tmpdir = TemporaryDirectory()
+        with ZipArchive(self.path, "r") as fd:
+            fd.extractall(self.tmpdir.name)
+
+        # Move the library files stored in the `.data` folder into place.
+        pattern = os.path.join(self.tmpdir.name, "*.data", "*lib")
+        for libdir in glob.glob(pattern):
+            for name in os.listdir(libdir):
+                shutil.move(os.path.join(libdir, name), self.tmpdir.name)
+
+    def cleanup(self):
+        """Clean the temporary installation directory."""
+
+        self.tmpdir.cleanup()
+        self.tmpdir = None
+
+    @property
+    def topnames(self):
+        """Names of the top-level modules."""
+
+        if self.tmpdir is None:
+            raise OSError("{0} is not installed".format(self.path))
+
+        pattern = os.path.join(self.tmpdir.name, "*.dist-info", "top_level.txt")
+        for toplevel_path in glob.glob(pattern):
+            with io.open(toplevel_path, "r", encoding="utf-8") as fd:
+                value = [row.strip() for row in fd.readlines() if row.strip()]
+            return sorted(set(name.split("/")[0] for name in value))
+
+        # Guess them from the installation folder if there is no index.
+        value = []
+        for name in sorted(os.listdir(self.tmpdir.name)):
+            path = os.path.join(self.tmpdir.name, name)
+            modname, ext = os.path.splitext(name)
+            initpath = os.path.join(path, "__init__.py*")
+            if os.path.isdir(path) and glob.glob(initpath):
+                value.append(name)
+            elif ext in (".py", ".pyc") and re.match(r"\w+$", modname):
+                value.append(modname)
+        return value
+
+    @property
+    def filesize(self):
+        """Wheel file size."""
+
+        return os.path.getsize(self.path)
+
+    @property
+    def disksize(self):
+        """Size of the installed files on disk."""
+
+        if self.tmpdir is None:
+            raise OSError("{0} is not installed".format(self.path))
+
+        value = 0
+        for root, _dirs, filenames in os.walk(self.tmpdir.name):
+            for filename in filenames:
+                value += os.path.getsize(os.path.join(root, filename))
+        return value
+
+    def measure(self):
+        """Import the top-level modules in a fresh interpreter once.
+
+        Return a dictionary with the elapsed time in seconds, the number of
+        modules loaded from bytecode, from source code and from extension
+        modules, and the size of the bytecode files loaded.
+        """
+
+        if self.tmpdir is None:
+            raise OSError("{0} is not installed".format(self.path))
+
+        env = dict(os.environ)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env.pop("PYTHONPYCACHEPREFIX", None)
+        args = [self.python, "-s", "-c", IMPORT_SCRIPT, self.tmpdir.name]
+        # `Popen` is not a context manager in Python 2, and `communicate`
+        # already waits for the process and closes its pipes.
+        proc = subprocess.Popen(  # pylint: disable=consider-using-with
+            args + self.topnames, env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("cannot import {0}:\n{1}".format(
+                self.path, err.decode("utf-8", "replace")))
+        return json.loads(out.decode("utf-8"))
+
+    def run(self, repeat=5):
+        """Measure cold and warm imports `repeat` times each.
+
+        Cold imports happen right after a fresh installation, while warm
+        imports reuse the same installation (and hence any bytecode cached
+        by the previous imports). Return a dictionary with the file sizes
+        and the median of the measurements.
+        """
+
+        if repeat < 1:
+            raise ValueError("repeat must be a positive integer")
+
+        cold = []
+        warm = []
+        for _ in range(repeat):
+            self.install()
+            try:
+                cold.append(self.measure())
+            finally:
+                self.cleanup()
+
+        self.install()
+        try:
+            disksize = self.disksize
+            self.measure()
+            for _ in range(repeat):
+                warm.append(self.measure())
+        finally:
+            self.cleanup()
+
+        return {
+            "filesize": self.filesize,
+            "disksize": disksize,
+            "cold": self.median(cold),
+            "warm": self.median(warm),
+        }
+
+    @staticmethod
+    def median(results):
+        """Return the result with the median elapsed time."""
+
+        results = sorted(results, key=lambda item: item["time"])
+        return results[len(results) // 2]
@@ -26,11 +26,20 @@
 
 import os
 import re
+import ast
+import sys
 import shutil
 import base64
+import struct
+import marshal
 import hashlib
 import py_compile
 from tempfile import NamedTemporaryFile
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp  # pylint: disable=deprecated-module
+    MAGIC_NUMBER = imp.get_magic()
 try:
     from winmagic import magic
 except ImportError:
@@ -80,8 +89,19 @@ class PythonFile(object):
 
         return False
 
-    def compile(self):
-        """Replace the Python source code file with the bytecode file."""
+    def compile(self, optimize=-1, strip_docstrings=False, strip_debug=False,
+                dfile=None):
+        """Replace the Python source code file with the bytecode file.
+
+        The `optimize` level has the same meaning as in :func:`compile`
+        (only supported by Python 3.2+). Docstrings and ``if __debug__``
+        blocks can also be removed from the source code before compiling.
+        The `dfile` is the source filename stored in the bytecode file
+        (by default, the current path).
+        """
+
+        if dfile is None:
+            dfile = self.path
 
         if self.is_pycfile():
             raise ValueError("cannot compile Python bytecode file")
@@ -96,7 +116,19 @@ class PythonFile(object):
 
         # Compile the source file.
         with NamedTemporaryFile(dir=os.path.dirname(self.path)) as tmpfile:
-            py_compile.compile(self.path, tmpfile.name)
+            if strip_docstrings or strip_debug:
+                self._compile_stripped(tmpfile.name, optimize=optimize,
+                                       strip_docstrings=strip_docstrings,
+                                       strip_debug=strip_debug, dfile=dfile)
+            else:
+                kwargs = {} if optimize == -1 else {"optimize": optimize}
+                try:
+                    py_compile.compile(self.path, tmpfile.name, dfile,
+                                       doraise=True, **kwargs)
+                except py_compile.PyCompileError as err:
+                    raise SyntaxError("cannot compile {0}: {1}".format(
+                        dfile, err.exc_value))
+                self._clear_mtime(tmpfile.name)
             shutil.copyfile(tmpfile.name, opath)
 
         # Keep the source file permissions in the bytecode file.
@@ -107,6 +139,60 @@ class PythonFile(object):
             os.remove(self.path)
         self.path = opath
 
+    def _compile_stripped(self, cfile, optimize=-1, strip_docstrings=False,
+                          strip_debug=False, dfile=None):
+        """Compile the source code into `cfile` after stripping its AST."""
+
+        if dfile is None:
+            dfile = self.path
+
+        with open(self.path, "rb") as fd:
+            source = fd.read()
+        tree = ast.parse(source, dfile)
+        tree = SourceStripper(docstrings=strip_docstrings,
+                              debug=strip_debug).visit(tree)
+        tree = ast.fix_missing_locations(tree)
+        if optimize != -1:
+            code = compile(tree, dfile, "exec", dont_inherit=True,
+                           optimize=optimize)
+        else:
+            code = compile(tree, dfile, "exec", dont_inherit=True)
+
+        # Build the bytecode header from the source file metadata, with a
+        # fixed source mtime (see :meth:`_clear_mtime`).
+        istat = os.stat(self.path)
+        mtime = struct.pack("<I", 0)
+        size = struct.pack("<I", istat.st_size & 0xFFFFFFFF)
+        if sys.version_info >= (3, 7):
+            header = MAGIC_NUMBER + struct.pack("<I", 0) + mtime + size
+        elif sys.version_info >= (3, 3):
+            header = MAGIC_NUMBER + mtime + size
+        else:
+            header = MAGIC_NUMBER + mtime
+
+        with open(cfile, "wb") as fd:
+            fd.write(header)
+            fd.write(marshal.dumps(code))
+
+    @staticmethod
+    def _clear_mtime(cfile):
+        """Set to zero the source mtime stored in a bytecode file header.
+
+        The source file is deleted after compiling, so the mtime is never
+        checked, and a fixed value keeps the bytecode files reproducible.
+        Hash-based bytecode files are kept unchanged.
+        """
+
+        with open(cfile, "r+b") as fd:
+            if sys.version_info >= (3, 7):
+                flags = struct.unpack("<I", fd.read(8)[4:])[0]
+                if flags != 0:
+                    return
+                fd.seek(8)
+            else:
+                fd.seek(4)
+            fd.write(struct.pack("<I", 0))
+
     @property
     def filesize(self):
         """File size."""
@@ -128,3 +214,62 @@ class PythonFile(object):
         hash_value = hash_value.decode().rstrip("=")
         hash_value = "{0}={1}".format(hash_obj.name, hash_value)
         return hash_value
+
+
+class SourceStripper(ast.NodeTransformer):
+    """AST pass removing docstrings and ``if __debug__`` blocks."""
+
+    def __init__(self, docstrings=True, debug=True):
+
+        super(SourceStripper, self).__init__()
+        self.docstrings = docstrings
+        self.debug = debug
+
+    def generic_visit(self, node):
+        """Strip the children of a node and keep its blocks non-empty."""
+
+        # Remember which statement blocks were not empty before stripping.
+        fields = [field for field in ("body", "orelse", "finalbody")
+                  if isinstance(getattr(node, field, None), list) and
+                  getattr(node, field)]
+        docstring = "body" in fields and self.is_docstring(node, node.body[0])
+
+        node = super(SourceStripper, self).generic_visit(node)
+
+        # Remove the docstring, but prevent any other string from taking its
+        # place (a `pass` is never put ahead of a `__future__` import, since
+        # only a docstring may precede it).
+        body = getattr(node, "body", None)
+        if docstring and self.docstrings:
+            del body[0]
+        if (not docstring or self.docstrings) and body and self.is_docstring(
+                node, body[0]):
+            body.insert(0, ast.copy_location(ast.Pass(), body[0]))
+        for field in fields:
+            block = getattr(node, field)
+            if not block:
+                block.append(ast.copy_location(ast.Pass(), node))
+        return node
+
+    def visit_If(self, node):  # pylint: disable=invalid-name
+        """Replace ``if __debug__`` blocks with their ``else`` branch."""
+
+        node = self.generic_visit(node)
+        test = node.test
+        if self.debug and isinstance(test, ast.Name) and test.id == "__debug__":
+            return node.orelse or None
+        return node
+
+    @staticmethod
+    def is_docstring(node, child):
+        """Return True if `child` is the docstring of `node`."""
+
+        if not isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef,
+                                 getattr(ast, "AsyncFunctionDef", ()))):
+            return False
+        if not isinstance(child, ast.Expr):
+            return False
+        if sys.version_info >= (3, 8):
+            return (isinstance(child.value, ast.Constant) and
+                    isinstance(child.value.value, str))
+        return isinstance(child.value, ast.Str)
@@ -0,0 +1,182 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 Víctor Molina García
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+""":class:`WheelDelta` class encapsulation."""
+
+import os
+import re
+import json
+import shutil
+from zipfile import ZipInfo
+from . WheelFile import WheelFile
+from . ZipArchive import ZipArchive
+from . ZipArchive import stream_hash
+
+
+class WheelDelta(ZipArchive):
+    """Interface for delta files between two versions of a wheel file.
+
+    A delta file is a zip archive with a JSON manifest, which describes
+    every member of the new wheel file, and the payloads of the members
+    that are new or changed with respect to the previous wheel file.
+    """
+
+    manifest_name = "DELTA.json"
+    payload_dir = "payload/"
+
+    @property
+    def manifest(self):
+        """Delta manifest."""
+
+        return json.loads(self.read(self.manifest_name).decode("utf-8"))
+
+    def build(self, base_path, path):
+        """Store the differences between a base wheel and a new wheel.
+
+        Return the manifest, which lists the changed, added and removed
+        members.
+        """
+
+        with open(base_path, "rb") as fd:
+            base_hash = stream_hash(fd)
+
+        manifest = {
+            "base": os.path.basename(base_path),
+            "base_hash": base_hash,
+            "target": os.path.basename(path),
+            "members": [],
+            "changed": [],
+            "added": [],
+            "removed": [],
+        }
+        with ZipArchive(base_path, "r") as basefd:
+            with ZipArchive(path, "r") as fd:
+                base_names = set(basefd.namelist())
+                for info in fd.infolist():
+                    name = info.filename
+                    if name not in base_names:
+                        manifest["added"].append(name)
+                        source = "payload"
+                    elif self.is_same(basefd, fd, name):
+                        source = "base"
+                    else:
+                        manifest["changed"].append(name)
+                        source = "payload"
+                    if source == "payload":
+                        self.writestr(self.payload_dir + name, fd.read(name))
+                    manifest["members"].append({
+                        "name": name,
+                        "source": source,
+                        "date_time": list(info.date_time),
+                        "external_attr": info.external_attr,
+                        "compress_type": info.compress_type,
+                    })
+                names = set(fd.namelist())
+                manifest["removed"] = sorted(base_names - names)
+
+        self.writestr(self.manifest_name, json.dumps(manifest, indent=1))
+        return manifest
+
+    @staticmethod
+    def is_same(basefd, fd, name):
+        """Return True if a member is byte-identical in both archives."""
+
+        baseinfo = basefd.getinfo(name)
+        info = fd.getinfo(name)
+        if (baseinfo.file_size, baseinfo.CRC) != (info.file_size, info.CRC):
+            return False
+        return basefd.hash(name) == fd.hash(name)
+
+    @staticmethod
+    def check_manifest(manifest):
+        """Raise ValueError if a manifest has unsafe file or member names.
+
+        The target must be a plain wheel filename, so that the rebuilt wheel
+        file stays inside its output folder, and member names cannot be
+        absolute or contain ``..`` segments.
+        """
+
+        target = manifest["target"]
+        if (target != os.path.basename(target) or "\\" in target or
+                not target.endswith(".whl")):
+            raise ValueError("invalid target wheel filename: {0}".format(
+                target))
+        for member in manifest["members"]:
+            name = member["name"]
+            parts = name.replace("\\", "/").split("/")
+            if (not name or name.startswith(("/", "\\")) or
+                    re.match(r"[A-Za-z]:", name) or ".." in parts):
+                raise ValueError("invalid member name: {0}".format(name))
+
+    def apply(self, base_path, outdir=None, jobs=None):
+        """Rebuild the new wheel file from the base wheel file.
+
+        The rebuilt wheel file is checked against its RECORD file. Return
+        the path to the rebuilt wheel file. A ValueError is raised if the
+        rebuilt wheel file would replace the base wheel file, or if the
+        manifest is unsafe (see :meth:`check_manifest`).
+        """
+
+        manifest = self.manifest
+        self.check_manifest(manifest)
+        with open(base_path, "rb") as fd:
+            if stream_hash(fd) != manifest["base_hash"]:
+                raise ValueError("{0} is not the base wheel of {1}".format(
+                    base_path, self.filename))
+
+        if outdir is None:
+            outdir = os.path.dirname(base_path)
+        path = os.path.join(outdir, manifest["target"])
+        if (os.path.normcase(os.path.realpath(path)) ==
+                os.path.normcase(os.path.realpath(base_path))):
+            raise ValueError("{0} would overwrite the base wheel, choose "
+                             "another output folder".format(path))
+        tmppath = "{0}.tmp".format(path)
+
+        try:
+            with ZipArchive(base_path, "r") as basefd:
+                with ZipArchive(tmppath, "w") as fd:
+                    for member in manifest["members"]:
+                        name = member["name"]
+                        if member["source"] == "base":
+                            data = basefd.read(name)
+                        else:
+                            data = self.read(self.payload_dir + name)
+                        info = ZipInfo(name, tuple(member["date_time"]))
+                        info.external_attr = member["external_attr"]
+                        info.compress_type = member["compress_type"]
+                        fd.writestr(info, data)
+
+            with WheelFile(tmppath, "r") as fd:
+                errors = fd.verify(jobs=jobs)
+            if errors:
+                raise ValueError("{0} does not match its RECORD: {1}".format(
+                    manifest["target"], ", ".join(
+                        "{0} ({1})".format(*item) for item in errors)))
+
+            shutil.move(tmppath, path)
+        finally:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+
+        return path
@@ -27,18 +27,57 @@ from __future__ import print_function
 
 import io
 import os
+import re
 import sys
+import csv
 import glob
 import shutil
+import hashlib
 import fnmatch
+import threading
+import multiprocessing
 import distutils.util
 from distutils import sysconfig
 from zipfile import ZIP_DEFLATED
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 from . PythonFile import PythonFile
 from . ZipArchive import ZipArchive
+from . ZipArchive import stream_hash
 from . TemporaryDirectory import TemporaryDirectory
 
 
+# Wildcard patterns of the members removed by each strip profile (see
+# :meth:`WheelFile.match_pattern` for the pattern syntax).
+STRIP_PROFILES = {
+    "tests": [
+        "test/", "tests/", "conftest.py",
+    ],
+    "stubs": [
+        "*.pyi",
+    ],
+    "docs": [
+        "doc/", "docs/", "*.rst", "*.md",
+    ],
+    "pycache": [
+        "__pycache__/",
+    ],
+    "licenses": [
+        "=LICENSE*", "=LICENCE*", "=COPYING*",
+    ],
+}
+
+# Hash algorithms accepted in RECORD files (the wheel specification forbids
+# md5 and sha1, `hashlib.algorithms_available` is new in Python 2.7.9 and
+# the variable-length shake digests cannot be used).
+RECORD_HASHES = set(
+    name for name in getattr(hashlib, "algorithms_available", (
+        "sha224", "sha256", "sha384", "sha512"))
+    if name.lower() not in ("md5", "sha1") and not name.startswith("shake_"))
+
+
 class WheelFile(ZipArchive):
     """Interface for wheel files."""
 
@@ -57,7 +96,12 @@ class WheelFile(ZipArchive):
         self.extractall(self.tmpdir.name)
 
     def pack(self, path=None):
-        """Pack wheel contents into a wheel file again."""
+        """Pack wheel contents into a wheel file again.
+
+        The `path` can also be a writable binary stream, even if it is not
+        seekable (e.g. a pipe), in which case the archive is written to it
+        directly using data descriptors (only supported by Python 3.5+).
+        """
 
         if self.tmpdir is None:
             raise OSError("{0} is not unpacked".format(self.filename))
@@ -65,8 +109,9 @@ class WheelFile(ZipArchive):
         if path is None:
             path = self.filename
 
-        # Store unpacked contents into a temporary zip file.
-        zippath = "{0}.zip".format(self.tmpdir.name)
+        # Store unpacked contents into a temporary zip file or the stream.
+        stream = hasattr(path, "write")
+        zippath = path if stream else "{0}.zip".format(self.tmpdir.name)
         zipfold = os.path.normpath(self.tmpdir.name)
         with ZipArchive(zippath, "w", compression=ZIP_DEFLATED) as fd:
             for dirpath, dirnames, filenames in os.walk(self.tmpdir.name):
@@ -79,7 +124,8 @@ class WheelFile(ZipArchive):
                         fd.write(item, os.path.relpath(item, zipfold))
 
         # Move temporary zip file into final destination.
-        shutil.move(zippath, path)
+        if not stream:
+            shutil.move(zippath, path)
 
     def cleanup(self):
         """Clean the temporary unpacking directory."""
@@ -87,52 +133,335 @@ class WheelFile(ZipArchive):
         self.tmpdir.cleanup()
         self.tmpdir = None
 
-    def compile_files(self, exclude=None, verbose=False):
-        """Compile non-excluded Python files within unpacked wheel file."""
+    def strip_files(self, patterns, verbose=False):
+        """Remove the files matching any pattern within unpacked wheel file.
+
+        The files inside the dist-info folder are never removed. Return the
+        number of bytes saved.
+        """
+
+        if self.tmpdir is None:
+            raise OSError("{0} is not unpacked".format(self.filename))
 
         log = print if verbose else (lambda *args, **kwargs: None)
 
-        # Read the initial record.
-        index = None
-        record = self.record
-        record_filenames = [row[0] for row in record]
+        names = []
+        for root, _dirs, filenames in os.walk(self.tmpdir.name):
+            for filename in filenames:
+                ipath = os.path.join(root, filename)
+                ipath_rel = os.path.relpath(ipath, self.tmpdir.name)
+                names.append("/".join(ipath_rel.split(os.sep)))
+        copies = self.find_copies(names, patterns)
+
+        saved = 0
+        stripped = set()
+        for name in sorted(names):
+            if self.is_stripped(name, patterns, copies):
+                log("Stripping: {0}".format(name))
+                ipath = os.path.join(self.tmpdir.name, *name.split("/"))
+                saved += os.path.getsize(ipath)
+                stripped.add(name)
+                os.remove(ipath)
+
+        # Remove the stripped entries from the record.
+        self.record = [row for row in self.record if row[0] not in stripped]
+        log("Stripped: {0} files ({1} bytes)".format(len(stripped), saved))
+        return saved
+
+    @staticmethod
+    def is_stripped(name, patterns, copies=()):
+        """Return True if a member matches any of the strip patterns.
+
+        Patterns starting with ``=`` only match the members in `copies`,
+        i.e. the ones with a byte-identical copy in the dist-info folder
+        (see :meth:`find_copies`).
+        """
+
+        if not patterns or re.match(r"[^/]+\.dist-info/", name):
+            return False
+        for pattern in patterns:
+            if pattern.startswith("="):
+                if name in copies and WheelFile.match_pattern(name,
+                                                              pattern[1:]):
+                    return True
+            elif WheelFile.match_pattern(name, pattern):
+                return True
+        return False
+
+    @staticmethod
+    def match_pattern(name, pattern):
+        """Return True if a member name matches a strip pattern.
+
+        Patterns ending in ``/`` match folder names at any depth, other
+        patterns with ``/`` match the whole member path segment by segment
+        and the remaining patterns match the file name only. Wildcards
+        never match across ``/``.
+        """
+
+        parts = name.rstrip("/").split("/")
+        if pattern.endswith("/"):
+            folders = parts if name.endswith("/") else parts[:-1]
+            return any(fnmatch.fnmatch(part, pattern[:-1])
+                       for part in folders)
+        if "/" in pattern:
+            subpatterns = pattern.split("/")
+            return (len(parts) == len(subpatterns) and
+                    all(fnmatch.fnmatch(part, subpattern)
+                        for part, subpattern in zip(parts, subpatterns)))
+        return not name.endswith("/") and fnmatch.fnmatch(parts[-1], pattern)
+
+    def find_copies(self, names, patterns):
+        """Return the members with a byte-identical copy in dist-info folder.
+
+        Only the members matching a strip pattern starting with ``=`` are
+        checked. The members are read from the unpacking directory if the
+        wheel file is unpacked, otherwise from the archive.
+        """
+
+        patterns = [item[1:] for item in patterns or [] if item[:1] == "="]
+        distinfo = set(name for name in names if not name.endswith("/") and
+                       re.match(r"[^/]+\.dist-info/", name))
+        candidates = [name for name in names if not name.endswith("/") and
+                      name not in distinfo and
+                      any(self.match_pattern(name, item) for item in patterns)]
+        if not candidates:
+            return set()
+
+        digests = set(self.digest(name) for name in distinfo)
+        return set(name for name in candidates if self.digest(name) in digests)
+
+    def digest(self, name):
+        """Return the size and the hash of a member."""
+
+        if self.tmpdir is None:
+            return self.getinfo(name).file_size, self.hash(name)
+        ipath = os.path.join(self.tmpdir.name, *name.split("/"))
+        with open(ipath, "rb") as fd:
+            return os.path.getsize(ipath), stream_hash(fd)
+
+    def compile_files(self, exclude=None, verbose=False, **kwargs):
+        """Compile non-excluded Python files within unpacked wheel file.
+
+        Extra keyword arguments are passed to :meth:`PythonFile.compile`.
+        """
+
+        log = print if verbose else (lambda *args, **kwargs: None)
 
         # Loop over the files inside the wheel package.
+        updates = {}
         for root, _dirs, filenames in os.walk(self.tmpdir.name):
 
             for filename in filenames:
 
                 ipath = os.path.join(root, filename)
                 ipath_rel = os.path.relpath(ipath, self.tmpdir.name)
+                name = "/".join(ipath_rel.split(os.sep))
 
-                if exclude is not None and fnmatch.fnmatch(ipath_rel, exclude):
-                    log("Skipping: {0} (excluded)".format(ipath_rel))
-                    continue
-
-                # Try to open as Python file.
-                try:
-                    fileobj = PythonFile(ipath)
-                except ValueError:
-                    log("Skipping: {0} (non-Python file)".format(ipath_rel))
-                    continue
-
-                if not fileobj.is_pyfile():
-                    log("Skipping: {0} (non-Python file)".format(ipath_rel))
-                    continue
-
-                # Compile if it is a Python source file.
-                log("Compiling: {0}".format(ipath_rel))
-                fileobj.compile()
-                opath = fileobj.path
-                opath_rel = os.path.relpath(opath, self.tmpdir.name)
-                # Update the entry in the record.
-                index = record_filenames.index(ipath_rel)
-                record[index] = [opath_rel, fileobj.hash, str(fileobj.filesize)]
-                self.record = record
-
-        # Update the wheel tag inside the dist-info.
+                row = self.compile_member(name, exclude=exclude, log=log,
+                                          **kwargs)
+                if row is not None:
+                    updates[name] = row
+
+        # Update the entries in the record and the wheel tag.
+        self.record = [updates.get(row[0], row) for row in self.record]
         self.tag = self.get_compiled_tag()
 
+    def convert(self, outdir=None, exclude=None, verbose=False, stream=None,
+                **kwargs):
+        """Compile the wheel into a new wheel file with an overlapped pipeline.
+
+        Reading the archive members, compiling them and compressing them
+        into the output archive run concurrently (see
+        :class:`ConvertPipeline`), where the `jobs` and `queue_size`
+        keyword arguments set the number of compilation threads and the
+        size of the queues between stages. Members matching any of the
+        `strip` patterns are dropped (see :meth:`strip_files`). Extra
+        keyword arguments are passed to :meth:`PythonFile.compile`. Return
+        the path to the compiled wheel.
+
+        If a writable binary `stream` is given, the compiled wheel is
+        written to it instead (see :meth:`pack`), the log messages go to
+        stderr and only the compiled wheel filename is returned.
+        """
+
+        if self.tmpdir is not None:
+            raise OSError("{0} is already unpacked".format(self.filename))
+
+        lock = threading.Lock()
+        logfile = sys.stdout if stream is None else sys.stderr
+        def log(*args, **kwargs):
+            if verbose:
+                with lock:
+                    print(*args, file=logfile, **kwargs)
+
+        pipeline = ConvertPipeline(self, jobs=kwargs.pop("jobs", None),
+                                   queue_size=kwargs.pop("queue_size", 32),
+                                   log=log)
+        strip = kwargs.pop("strip", None)
+
+        # Extract the dist-info folder first to learn the output name.
+        infos = self.infolist()
+        distinfo = [info for info in infos
+                    if re.match(r"[^/]+\.dist-info/", info.filename)]
+        members = [info for info in infos if info not in distinfo]
+        copies = self.find_copies([info.filename for info in infos], strip)
+        stripped = [info for info in members
+                    if self.is_stripped(info.filename, strip, copies)]
+        members = [info for info in members if info not in stripped]
+        self.tmpdir = TemporaryDirectory()
+        zippath = "{0}.zip".format(self.tmpdir.name)
+        try:
+            for info in distinfo:
+                self.extract(info, self.tmpdir.name)
+            if stream is not None:
+                path = self.get_compiled_wheelname()
+                log("Streaming: {0}".format(path))
+            else:
+                if outdir is None:
+                    outdir = os.path.dirname(self.filename)
+                path = os.path.join(outdir, self.get_compiled_wheelname())
+                log("Saving: {0}".format(path))
+            for info in stripped:
+                log("Stripping: {0}".format(info.filename))
+
+            target = zippath if stream is None else stream
+            with ZipArchive(target, "w", compression=ZIP_DEFLATED) as fd:
+                updates = pipeline.run(members, fd, exclude=exclude, **kwargs)
+
+                # Update the dist-info folder and store it at the end.
+                names = set(info.filename for info in stripped)
+                self.record = [updates.get(row[0]) or row
+                               for row in self.record if row[0] not in names]
+                self.tag = self.get_compiled_tag()
+                for info in distinfo:
+                    pipeline.write_member(fd, info.filename)
+                if pipeline.errors:
+                    raise pipeline.errors[0]
+
+            # Move temporary zip file into final destination.
+            if stream is None:
+                shutil.move(zippath, path)
+            if stripped:
+                log("Stripped: {0} members ({1} bytes, {2} compressed)".format(
+                    len(stripped), sum(info.file_size for info in stripped),
+                    sum(info.compress_size for info in stripped)))
+        finally:
+            if os.path.exists(zippath):
+                os.remove(zippath)
+            self.cleanup()
+
+        return path
+
+    def compile_member(self, name, exclude=None, log=print, **kwargs):
+        """Compile an unpacked member and return its new record row.
+
+        Return None if the member is excluded or it is not a Python file.
+        """
+
+        if exclude is not None and fnmatch.fnmatch(name, exclude):
+            log("Skipping: {0} (excluded)".format(name))
+            return None
+
+        # Try to open as Python file.
+        ipath = os.path.join(self.tmpdir.name, *name.split("/"))
+        try:
+            fileobj = PythonFile(ipath)
+        except ValueError:
+            log("Skipping: {0} (non-Python file)".format(name))
+            return None
+
+        if not fileobj.is_pyfile():
+            log("Skipping: {0} (non-Python file)".format(name))
+            return None
+
+        # Compile if it is a Python source file.
+        log("Compiling: {0}".format(name))
+        fileobj.compile(dfile=name, **kwargs)
+        opath_rel = os.path.relpath(fileobj.path, self.tmpdir.name)
+        oname = "/".join(opath_rel.split(os.sep))
+        return [oname, fileobj.hash, str(fileobj.filesize)]
+
+    def verify(self, jobs=None):
+        """Check the wheel members against the RECORD hashes and sizes.
+
+        The members are hashed straight from the archive and split among
+        `jobs` worker processes (all available CPUs by default). Return a
+        list of ``(member, reason)`` tuples, one per mismatch found.
+        """
+
+        names = [name for name in self.namelist() if not name.endswith("/")]
+        record_names = [name for name in names
+                        if re.match(r"[^/]+\.dist-info/RECORD$", name)]
+        if len(record_names) != 1:
+            return [(self.filename, "cannot find a unique RECORD file")]
+
+        # The RECORD file is a CSV file (quoted names may contain commas).
+        content = self.read(record_names[0])
+        if sys.version_info[0] < 3:
+            record = [[item.decode("utf-8") for item in row]
+                      for row in csv.reader(content.splitlines())]
+        else:
+            record = list(csv.reader(content.decode("utf-8").splitlines()))
+        record = [row for row in record if row]
+
+        # Check membership and sizes without decompressing anything.
+        errors = []
+        tasks = []
+        listed = set()
+        for row in record:
+            name, hash_value, size = (row + ["", ""])[:3]
+            listed.add(name)
+            try:
+                info = self.getinfo(name)
+            except KeyError:
+                errors.append((name, "missing from archive"))
+                continue
+            hash_type = hash_value.split("=")[0]
+            if size and str(info.file_size) != size:
+                errors.append((name, "size mismatch: {0} != {1}".format(
+                    info.file_size, size)))
+            elif name in record_names:
+                continue
+            elif not hash_value:
+                errors.append((name, "missing hash"))
+            elif "=" not in hash_value or hash_type not in RECORD_HASHES:
+                errors.append((name, "unsupported hash: {0}".format(
+                    hash_value)))
+            else:
+                tasks.append((info.file_size, name, hash_value))
+        for name in names:
+            if name not in listed and not re.match(
+                    r"[^/]+\.dist-info/RECORD\.(jws|p7s)$", name):
+                errors.append((name, "not listed in RECORD"))
+
+        # Balance the hashing work by size among the worker processes.
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        jobs = max(1, min(jobs, len(tasks)))
+        chunks = [[] for _ in range(jobs)]
+        loads = [0] * jobs
+        for size, name, hash_value in sorted(tasks, reverse=True):
+            i = loads.index(min(loads))
+            chunks[i].append((name, hash_value))
+            loads[i] += size
+
+        if jobs == 1:
+            results = [_verify_hashes((self.filename, chunk))
+                       for chunk in chunks]
+        else:
+            # `Pool` is not a context manager in Python 2.
+            pool = multiprocessing.Pool(jobs)  # pylint: disable=consider-using-with
+            try:
+                results = pool.map(_verify_hashes,
+                                   [(self.filename, chunk) for chunk in chunks])
+            finally:
+                pool.close()
+                pool.join()
+        for result in results:
+            errors.extend(result)
+
+        return sorted(errors)
+
     @property
     def record(self):
         """Wheel file record."""
@@ -198,38 +527,54 @@ class WheelFile(ZipArchive):
         with io.open(wheel_path, "w", encoding="utf-8") as fd:
             fd.write("".join(rows))
 
+        # Keep the WHEEL entry in the record consistent with the new file.
+        with open(wheel_path, "rb") as fd:
+            hash_value = stream_hash(fd)
+        wheel_name = "/".join([os.path.basename(distinfo_dir), "WHEEL"])
+        wheel_size = str(os.path.getsize(wheel_path))
+        self.record = [[wheel_name, hash_value, wheel_size]
+                       if row[0] == wheel_name else row for row in self.record]
+
     @property
-    def pkgname(self):
-        """Package name."""
+    def metadata(self):
+        """Lines of the wheel METADATA file.
+
+        The METADATA file is read from the archive if the wheel file is not
+        unpacked, so the package name and version are always available.
+        """
 
         if self.tmpdir is None:
-            raise OSError("{0} is not unpacked".format(self.filename))
+            names = [name for name in self.namelist()
+                     if re.match(r"[^/]+\.dist-info/METADATA$", name)]
+            if len(names) != 1:
+                raise OSError("cannot find a unique METADATA file in {0}"
+                              .format(self.filename))
+            return self.read(names[0]).decode("utf-8").splitlines(True)
 
         distinfo_dir = glob.glob("{0}/*.dist-info".format(self.tmpdir.name))[0]
         metadata_path = os.path.join(distinfo_dir, "METADATA")
 
         with io.open(metadata_path, "r", encoding="utf-8") as fd:
-            for row in fd.readlines():
-                if row.startswith("Name:"):
-                    value = row.strip("\n").split(":")[-1].strip()
-                    break
+            return fd.readlines()
+
+    @property
+    def pkgname(self):
+        """Package name."""
+
+        for row in self.metadata:
+            if row.startswith("Name:"):
+                value = row.strip("\n").split(":")[-1].strip()
+                break
         return value
 
     @property
     def pkgversion(self):
         """Package version."""
 
-        if self.tmpdir is None:
-            raise OSError("{0} is not unpacked".format(self.filename))
-
-        distinfo_dir = glob.glob("{0}/*.dist-info".format(self.tmpdir.name))[0]
-        metadata_path = os.path.join(distinfo_dir, "METADATA")
-
-        with io.open(metadata_path, "r", encoding="utf-8") as fd:
-            for row in fd.readlines():
-                if row.startswith("Version:"):
-                    value = row.strip("\n").split(":")[-1].strip()
-                    break
+        for row in self.metadata:
+            if row.startswith("Version:"):
+                value = row.strip("\n").split(":")[-1].strip()
+                break
         return value
 
     @property
@@ -272,3 +617,130 @@ class WheelFile(ZipArchive):
 
         return "{0}-{1}-{2}.bin.whl".format(self.pkgname, self.pkgversion,
                                             self.get_compiled_tag())
+
+
+class ConvertPipeline(object):
+    """Overlapped read, compile and write stages of a wheel conversion.
+
+    The members are extracted by a reader thread, compiled by `jobs`
+    threads (up to 4 by default) and written into the output archive by
+    the calling thread, with bounded queues between the stages. After an
+    error, the reader stops and the other stages drain their queues so that
+    no thread stays blocked.
+
+    The compiler holds the GIL, so the compilation threads only overlap the
+    file I/O around compiling (reading sources, writing bytecode files)
+    with each other and with the other stages, and a few of them suffice.
+    """
+
+    def __init__(self, wheel, jobs=None, queue_size=32, log=print):
+
+        if jobs is None:
+            jobs = min(4, multiprocessing.cpu_count())
+        self.wheel = wheel
+        self.jobs = max(1, jobs)
+        self.log = log
+        self.errors = []
+        self.read_queue = queue.Queue(queue_size)
+        self.write_queue = queue.Queue(queue_size)
+
+    def run(self, members, fd, exclude=None, **kwargs):
+        """Extract, compile and write the members into the archive `fd`.
+
+        Extra keyword arguments are passed to :meth:`PythonFile.compile`.
+        Return a dictionary with the new record row of every member (None
+        for the members that are not compiled).
+        """
+
+        threads = [threading.Thread(target=self.read_stage, args=(members,))]
+        threads += [threading.Thread(target=self.compile_stage,
+                                     args=(exclude, kwargs))
+                    for _ in range(self.jobs)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        updates = self.write_stage(fd)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+        return updates
+
+    def read_stage(self, members):
+        """Extract the members and queue them for compilation."""
+
+        for i, info in enumerate(members):
+            if self.errors:
+                break
+            try:
+                self.wheel.extract(info, self.wheel.tmpdir.name)
+                self.read_queue.put((i, info.filename))
+            except Exception as ex:  # pylint: disable=broad-except
+                self.errors.append(ex)
+        for _ in range(self.jobs):
+            self.read_queue.put(None)
+
+    def compile_stage(self, exclude, kwargs):
+        """Compile the extracted members and queue them for writing."""
+
+        for i, name in iter(self.read_queue.get, None):
+            if self.errors:
+                continue
+            try:
+                row = None
+                if not name.endswith("/"):
+                    row = self.wheel.compile_member(name, exclude, self.log,
+                                                    **kwargs)
+                self.write_queue.put((i, name, row))
+            except Exception as ex:  # pylint: disable=broad-except
+                self.errors.append(ex)
+        self.write_queue.put(None)
+
+    def write_stage(self, fd):
+        """Write the compiled members into the archive in their order.
+
+        Compression and writing both happen in the calling thread.
+        """
+
+        updates = {}
+        ready = {}
+        pending = self.jobs
+        while pending:
+            item = self.write_queue.get()
+            if item is None:
+                pending -= 1
+                continue
+            if self.errors:
+                continue
+            ready[item[0]] = item[1:]
+            while len(updates) in ready and not self.errors:
+                name, row = ready.pop(len(updates))
+                updates[name] = row
+                self.write_member(fd, name if row is None else row[0])
+        return updates
+
+    def write_member(self, fd, name):
+        """Write an unpacked member into the archive and delete it."""
+
+        path = os.path.join(self.wheel.tmpdir.name, *name.split("/"))
+        try:
+            fd.write(path, name)
+            if not name.endswith("/"):
+                os.remove(path)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.errors.append(ex)
+
+
+def _verify_hashes(args):
+    """Return the members of a wheel whose hash differs from the expected."""
+
+    filename, rows = args
+    errors = []
+    with ZipArchive(filename, "r") as fd:
+        for name, hash_value in rows:
+            actual = fd.hash(name, hash_value.split("=")[0])
+            if actual != hash_value:
+                errors.append((name, "hash mismatch: {0} != {1}".format(
+                    actual, hash_value)))
+    return errors
@@ -0,0 +1,327 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2022 Víctor Molina García
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+#
+""":class:`WorkQueue` class encapsulation."""
+from __future__ import print_function
+
+import io
+import os
+import sys
+import errno
+import json
+import time
+import socket
+import shutil
+import threading
+import traceback
+
+
+class WorkQueue(object):
+    """Wheel conversion queue stored in a (possibly shared) directory.
+
+    The queue directory contains the following folders:
+
+    - ``pending``: wheel files waiting to be converted.
+    - ``claimed/<worker>``: wheel files being converted by a worker.
+    - ``done``: compiled wheel files.
+    - ``finished``: wheel files converted successfully.
+    - ``failed``: wheel files whose conversion failed, with their logs.
+    - ``workers``: status files of the workers, used as heartbeats.
+    - ``tmp/<worker>``: scratch space of the workers.
+
+    Wheel files are claimed with atomic renames, so several workers on
+    different hosts can share the same queue through a network filesystem.
+    Wheel files must be copied into ``pending`` under a temporary name and
+    then renamed, since only files ending in ``.whl`` are claimed.
+    """
+
+    folders = ("pending", "claimed", "done", "finished", "failed",
+               "workers", "tmp")
+
+    def __init__(self, path, worker=None, heartbeat=30, timeout=300):
+
+        if heartbeat <= 0 or timeout <= 0:
+            raise ValueError("heartbeat and timeout must be positive")
+        self.path = path
+        if worker is None:
+            worker = "{0}-{1}".format(socket.gethostname(), os.getpid())
+        self.worker = worker
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.stats = None
+        self.lock = threading.Lock()
+
+    def folder(self, name, *args):
+        """Return the path to a queue folder."""
+
+        return os.path.join(self.path, name, *args)
+
+    def setup(self):
+        """Create the queue folders if they do not exist yet."""
+
+        for name in self.folders:
+            try:
+                os.makedirs(self.folder(name))
+            except OSError:
+                if not os.path.isdir(self.folder(name)):
+                    raise
+
+    def claim(self):
+        """Claim a pending wheel file and return its new path.
+
+        Return None if there are no pending wheel files left.
+        """
+
+        claimdir = self.folder("claimed", self.worker)
+        if not os.path.isdir(claimdir):
+            os.makedirs(claimdir)
+        for name in sorted(os.listdir(self.folder("pending"))):
+            if not name.endswith(".whl"):
+                continue
+            path = os.path.join(claimdir, name)
+            try:
+                os.rename(self.folder("pending", name), path)
+            except OSError:
+                # Another worker has been faster.
+                continue
+            return path
+        return None
+
+    def recover(self):
+        """Move back to the queue the claims of stale workers.
+
+        The scratch space of stale workers is removed too. Return the list
+        of recovered wheel filenames.
+        """
+
+        value = []
+        for worker in sorted(os.listdir(self.folder("claimed"))):
+            if worker == self.worker or self.is_alive(worker):
+                continue
+            claimdir = self.folder("claimed", worker)
+            for name in sorted(os.listdir(claimdir)):
+                try:
+                    os.rename(os.path.join(claimdir, name),
+                              self.folder("pending", name))
+                except OSError:
+                    # Another worker has recovered it already.
+                    continue
+                value.append(name)
+            try:
+                os.rmdir(claimdir)
+            except OSError:
+                pass
+        for worker in sorted(os.listdir(self.folder("tmp"))):
+            if worker == self.worker or self.is_alive(worker):
+                continue
+            shutil.rmtree(self.folder("tmp", worker), ignore_errors=True)
+        return value
+
+    def is_alive(self, worker):
+        """Return True if the worker status file is recent enough."""
+
+        try:
+            mtime = os.stat(self.folder("workers", worker + ".json")).st_mtime
+        except OSError:
+            return False
+        return time.time() - mtime < self.timeout
+
+    def read_status(self, worker):
+        """Return the status dictionary of a worker."""
+
+        path = self.folder("workers", worker + ".json")
+        with io.open(path, "r", encoding="utf-8") as fd:
+            return json.loads(fd.read())
+
+    def write_status(self, **kwargs):
+        """Update the status file of this worker atomically."""
+
+        path = self.folder("workers", self.worker + ".json")
+        tmppath = self.folder("workers", ".{0}.json.tmp".format(self.worker))
+        with self.lock:
+            self.stats.update(kwargs)
+            self.stats["seen"] = time.time()
+            text = json.dumps(self.stats, sort_keys=True)
+            if isinstance(text, bytes):
+                text = text.decode("utf-8")
+            with io.open(tmppath, "w", encoding="utf-8") as fd:
+                fd.write(text)
+            getattr(os, "replace", os.rename)(tmppath, path)
+
+    def publish(self, path, target):
+        """Move a file to `target` without overwriting an existing file.
+
+        Different source wheel files may lead to the same compiled wheel
+        filename, so an existing `target` is never replaced and an OSError
+        is raised instead. A hard link is used when available, since it
+        fails atomically if `target` exists already.
+        """
+
+        link = getattr(os, "link", None)
+        if link is not None:
+            try:
+                link(path, target)
+            except OSError as err:
+                if err.errno == errno.EEXIST:
+                    raise
+            else:
+                os.remove(path)
+                return
+        if os.path.exists(target):
+            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), target)
+        os.rename(path, target)
+
+    def process(self, path, convert):
+        """Convert a claimed wheel file and publish the result.
+
+        The `convert` callable receives the wheel path and an output
+        folder, and it must return the path to the compiled wheel file.
+        Return True if the conversion succeeded, otherwise False.
+        """
+
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        tmpdir = self.folder("tmp", self.worker)
+        if not os.path.isdir(tmpdir):
+            os.makedirs(tmpdir)
+
+        start = time.time()
+        try:
+            compiled_path = convert(path, tmpdir)
+            compiled_name = os.path.basename(compiled_path)
+            self.publish(compiled_path, self.folder("done", compiled_name))
+        except Exception:  # pylint: disable=broad-except
+            logpath = self.folder("failed", name + ".log")
+            text = traceback.format_exc()
+            if isinstance(text, bytes):
+                text = text.decode("utf-8", "replace")
+            with io.open(logpath, "w", encoding="utf-8") as fd:
+                fd.write(text)
+            try:
+                os.rename(path, self.folder("failed", name))
+            except OSError:
+                # The claim was recovered by another worker in the meantime.
+                pass
+            self.write_status(failed=self.stats["failed"] + 1)
+            return False
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+        try:
+            os.rename(path, self.folder("finished", name))
+        except OSError:
+            # The claim was recovered by another worker in the meantime.
+            pass
+        self.write_status(converted=self.stats["converted"] + 1,
+                          bytes=self.stats["bytes"] + size,
+                          busy=self.stats["busy"] + time.time() - start)
+        return True
+
+    def work(self, convert, poll=0, verbose=False):
+        """Claim and convert wheel files until the queue is empty.
+
+        If `poll` is positive, wait for new wheel files instead of exiting,
+        checking the queue every `poll` seconds.
+        """
+
+        log = print if verbose else (lambda *args, **kwargs: None)
+
+        self.setup()
+        self.stats = {
+            "worker": self.worker,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "state": "running",
+            "started": time.time(),
+            "converted": 0,
+            "failed": 0,
+            "bytes": 0,
+            "busy": 0.0,
+        }
+        self.write_status()
+
+        # Keep the status file fresh while converting long wheel files.
+        stop = threading.Event()
+        def beat():
+            stop.wait(self.heartbeat)
+            while not stop.is_set():
+                try:
+                    self.write_status()
+                except Exception as err:  # pylint: disable=broad-except
+                    # Keep beating, the queue folder may be back later.
+                    print("Heartbeat failed: {0}".format(err), file=sys.stderr)
+                stop.wait(self.heartbeat)
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            while True:
+                for name in self.recover():
+                    log("Recovered: {0}".format(name))
+                path = self.claim()
+                if path is None:
+                    if poll <= 0:
+                        break
+                    time.sleep(poll)
+                    continue
+                log("Claimed: {0}".format(os.path.basename(path)))
+                if not self.process(path, convert):
+                    log("Failed: {0}".format(os.path.basename(path)))
+        finally:
+            stop.set()
+            thread.join()
+            self.write_status(state="stopped")
+            try:
+                os.rmdir(self.folder("claimed", self.worker))
+            except OSError:
+                pass
+
+    def status(self):
+        """Return the queue depth and the statistics of every worker."""
+
+        value = {}
+        for name in ("pending", "done", "finished", "failed"):
+            value[name] = len([item for item in os.listdir(self.folder(name))
+                               if item.endswith(".whl")])
+        value["claimed"] = sum(len(os.listdir(self.folder("claimed", item)))
+                               for item in os.listdir(self.folder("claimed")))
+
+        workers = []
+        now = time.time()
+        for name in sorted(os.listdir(self.folder("workers"))):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue
+            try:
+                stats = self.read_status(name[:-5])
+            except (OSError, IOError, ValueError):
+                continue
+            if stats["state"] == "running" and not self.is_alive(name[:-5]):
+                stats["state"] = "stale"
+            elapsed = max(stats["seen"] - stats["started"], 1e-9)
+            stats["rate"] = 60 * stats["converted"] / elapsed
+            stats["throughput"] = stats["bytes"] / elapsed
+            stats["idle"] = now - stats["seen"]
+            workers.append(stats)
+        value["workers"] = workers
+        return value
@@ -24,12 +24,16 @@
 """:class:`ZipArchive` class encapsulation."""
 
 import os
+import time
+import base64
+import hashlib
+from contextlib import closing
 from zipfile import ZipFile
 from zipfile import ZipInfo
 
 
 class ZipArchive(ZipFile, object):
-    """Alternative :class:`~zipfile.ZipFile` with file permission handling."""
+    """Alternative :class:`~zipfile.ZipFile` with file metadata handling."""
 
     def _extract_member(self, member, targetpath, pwd):
         """Extract a :class:`zipfile.ZipInfo` object to a physical file."""
@@ -43,8 +47,18 @@ class ZipArchive(ZipFile, object):
         if attr != 0:
             os.chmod(targetpath, attr)
 
+        # Keep the member timestamp in the extracted file.
+        mtime = time.mktime(member.date_time + (0, 0, -1))
+        os.utime(targetpath, (mtime, mtime))
+
         return targetpath
 
+    def hash(self, member, hash_type="sha256", blocksize=65536):
+        """Return the hash of a member in wheel RECORD format."""
+
+        with closing(self.open(member)) as fd:
+            return stream_hash(fd, hash_type=hash_type, blocksize=blocksize)
+
     def __enter__(self):
         """Enter method when using the object as a context manager."""
 
@@ -54,3 +68,16 @@ class ZipArchive(ZipFile, object):
         """Exit method when using the object as a context manager."""
 
         self.close()
+
+
+def stream_hash(fd, hash_type="sha256", blocksize=65536):
+    """Return the hash of a binary stream in wheel RECORD format."""
+
+    hash_obj = hashlib.new(hash_type)
+    for block in iter(lambda: fd.read(blocksize), b""):
+        hash_obj.update(block)
+
+    hash_value = base64.urlsafe_b64encode(hash_obj.digest())
+    hash_value = hash_value.decode().rstrip("=")
+    hash_value = "{0}={1}".format(hash_obj.name, hash_value)
+    return hash_value
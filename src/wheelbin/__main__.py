@@ -28,29 +28,93 @@ from __future__ import print_function
 import os
 import sys
 import argparse
+from zipfile import ZIP_DEFLATED
 from . import __version__
 from . WheelFile import WheelFile
+from . WheelFile import STRIP_PROFILES
+from . WorkQueue import WorkQueue
+from . WheelDelta import WheelDelta
+from . ImportBenchmark import ImportBenchmark
+from . TemporaryDirectory import TemporaryDirectory
 
 
-def convert_wheel(whl_file, exclude=None, verbose=True):
-    """Generate a new wheel with only bytecode files."""
+def convert_wheel(whl_file, exclude=None, verbose=True, options=None):
+    """Generate a new wheel with only bytecode files and return its path.
 
-    whl_fold = os.path.dirname(whl_file)
+    The `options` dictionary accepts the following keys:
+
+    - `verify`: if True, check the new wheel against its RECORD file.
+    - `outdir`: folder for the new wheel (by default, the source folder).
+    - `stream`: writable binary stream where the new wheel is written
+      instead, in which case only its filename is returned.
+    - `delta_from`: previous compiled wheel used to also save a delta file
+      next to the new wheel (see :class:`WheelDelta`).
+
+    Other keys (e.g. `jobs`, `optimize` or `strip`) are passed to
+    :meth:`WheelFile.convert`.
+    """
+
+    options = dict(options or {})
+    verify = options.pop("verify", False)
+    outdir = options.pop("outdir", None)
+    stream = options.pop("stream", None)
+    delta_from = options.pop("delta_from", None)
+
+    whl_fold = os.path.dirname(whl_file) if outdir is None else outdir
     file_ext = os.path.splitext(whl_file)[-1]
     if file_ext != ".whl":
         raise TypeError("File to convert must be a *.whl")
+    if verify and stream is not None:
+        raise ValueError("cannot verify a wheel written to a stream")
+    if delta_from is not None and stream is not None:
+        raise ValueError("cannot compute a delta for a wheel written to a "
+                         "stream")
 
     with WheelFile(whl_file, "r") as whlfd:
-        # Unpack to temporary directory and compile.
-        whlfd.unpack()
-        whlfd.compile_files(exclude=exclude, verbose=verbose)
-        # Pack again with the appropriate compiled wheel filename.
-        compiled_whlname = whlfd.get_compiled_wheelname()
-        compiled_whlpath = os.path.join(whl_fold, compiled_whlname)
+        # Never replace the previous wheel before the delta is computed.
+        if delta_from is not None:
+            path = os.path.join(whl_fold, whlfd.get_compiled_wheelname())
+            if (os.path.normcase(os.path.realpath(path)) ==
+                    os.path.normcase(os.path.realpath(delta_from))):
+                raise ValueError("{0} would overwrite the previous wheel, "
+                                 "move it to another folder".format(path))
+
+        # Read, compile and pack again with the compiled wheel filename.
+        compiled_whlpath = whlfd.convert(whl_fold, exclude=exclude,
+                                         verbose=verbose, stream=stream,
+                                         **options)
+
+    if verify and not verify_wheel(compiled_whlpath, verbose=verbose,
+                                   jobs=options.get("jobs")):
+        raise ValueError("{0} does not match its RECORD".format(
+            compiled_whlpath))
+
+    if delta_from is not None:
+        delta_path = "{0}.delta".format(compiled_whlpath)
         if verbose:
-            print("Saving: {0}".format(compiled_whlpath))
-        whlfd.pack(compiled_whlpath)
-        whlfd.cleanup()
+            print("Saving: {0}".format(delta_path))
+        with WheelDelta(delta_path, "w", compression=ZIP_DEFLATED) as deltafd:
+            manifest = deltafd.build(delta_from, compiled_whlpath)
+        if verbose:
+            print("Delta: {0} changed, {1} added, {2} removed ({3} bytes)"
+                  .format(len(manifest["changed"]), len(manifest["added"]),
+                          len(manifest["removed"]),
+                          os.path.getsize(delta_path)))
+    return compiled_whlpath
+
+
+def verify_wheel(whl_file, verbose=True, jobs=None):
+    """Check that the wheel contents match its RECORD file."""
+
+    if verbose:
+        print("Verifying: {0}".format(whl_file))
+
+    with WheelFile(whl_file, "r") as whlfd:
+        errors = whlfd.verify(jobs=jobs)
+
+    for name, reason in errors:
+        print("Mismatch: {0} ({1})".format(name, reason), file=sys.stderr)
+    return not errors
 
 
 def progname():
@@ -64,10 +128,314 @@ def progname():
     return None
 
 
+def subprogname(command):
+    """Return program name for a subcommand."""
+
+    return "{0} {1}".format(progname() or os.path.basename(sys.argv[0]),
+                            command)
+
+
+def main_verify(args=None):
+    """Entry point for wheelbin verify."""
+
+    parser = argparse.ArgumentParser(
+        prog=subprogname("verify"),
+        description="Check wheel contents against their RECORD files.")
+    parser.add_argument(
+        "whl_files", nargs="+",
+        help="path to wheels being verified")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="call the script without printing messages")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of hashing processes (default: number of CPUs)")
+    args = parser.parse_args(args)
+
+    status = 0
+    for whl_file in args.whl_files:
+        if not verify_wheel(whl_file, verbose=not args.quiet, jobs=args.jobs):
+            status = 1
+    return status
+
+
+def benchmark_wheel(whl_file, compiled_whl_file=None, repeat=5,
+                    verbose=True):
+    """Compare the import time of a wheel and its compiled version."""
+
+    log = print if verbose else (lambda *args, **kwargs: None)
+
+    with TemporaryDirectory() as tmpdir:
+        if compiled_whl_file is None:
+            with WheelFile(whl_file, "r") as whlfd:
+                compiled_whl_file = whlfd.convert(tmpdir)
+
+        results = []
+        for path in (whl_file, compiled_whl_file):
+            log("Benchmarking: {0}".format(path))
+            results.append(ImportBenchmark(path).run(repeat=repeat))
+
+    rows = [
+        ("wheel size (bytes)", "filesize", None),
+        ("installed size (bytes)", "disksize", None),
+        ("cold import time (ms)", "cold", "time"),
+        ("cold modules from bytecode", "cold", "bytecode"),
+        ("cold modules from source", "cold", "source"),
+        ("cold extension modules", "cold", "extension"),
+        ("cold bytecode loaded (bytes)", "cold", "bytecode_size"),
+        ("warm import time (ms)", "warm", "time"),
+        ("warm modules from bytecode", "warm", "bytecode"),
+        ("warm modules from source", "warm", "source"),
+        ("warm extension modules", "warm", "extension"),
+        ("warm bytecode loaded (bytes)", "warm", "bytecode_size"),
+    ]
+    print("{0:<30} {1:>15} {2:>15}".format("", "source", "compiled"))
+    for title, key, subkey in rows:
+        values = [result[key] if subkey is None else result[key][subkey]
+                  for result in results]
+        if subkey == "time":
+            values = ["{0:.2f}".format(1000 * value) for value in values]
+        print("{0:<30} {1:>15} {2:>15}".format(title, *values))
+    return results
+
+
+def main_benchmark(args=None):
+    """Entry point for wheelbin benchmark."""
+
+    parser = argparse.ArgumentParser(
+        prog=subprogname("benchmark"),
+        description="Compare the import time of a wheel and its compiled "
+                    "version in fresh interpreter processes.")
+    parser.add_argument(
+        "whl_file",
+        help="path to the source wheel")
+    parser.add_argument(
+        "compiled_whl_file", nargs="?", default=None,
+        help="path to the compiled wheel (default: convert the source wheel)")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="call the script without printing progress messages")
+    parser.add_argument(
+        "-n", "--repeat", type=positive_int, default=5,
+        help="number of cold and warm imports measured (default: 5)")
+    args = parser.parse_args(args)
+
+    benchmark_wheel(args.whl_file, args.compiled_whl_file, repeat=args.repeat,
+                    verbose=not args.quiet)
+    return 0
+
+
+def main_worker(args=None):
+    """Entry point for wheelbin worker."""
+
+    parser = argparse.ArgumentParser(
+        prog=subprogname("worker"),
+        description="Convert the wheels of a queue folder, which can be "
+                    "shared among several hosts through a network filesystem.")
+    parser.add_argument(
+        "--queue", required=True,
+        help="path to the queue folder")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="call the script without printing messages")
+    parser.add_argument(
+        "--poll", type=float, default=0,
+        help="seconds between checks for new wheels (default: exit when "
+             "the queue is empty)")
+    parser.add_argument(
+        "--timeout", type=positive_float, default=300,
+        help="seconds without heartbeat before the claims of a worker are "
+             "recovered (default: 300)")
+    add_convert_arguments(parser)
+    args = parser.parse_args(args)
+
+    verbose = not args.quiet
+    options = convert_options(args)
+    def convert(whl_file, outdir):
+        return convert_wheel(whl_file, exclude=args.exclude, verbose=verbose,
+                             options=dict(options, outdir=outdir))
+
+    queue = WorkQueue(args.queue, timeout=args.timeout,
+                      heartbeat=min(30, args.timeout / 4))
+    queue.work(convert, poll=args.poll, verbose=verbose)
+    return 0
+
+
+def main_status(args=None):
+    """Entry point for wheelbin status."""
+
+    parser = argparse.ArgumentParser(
+        prog=subprogname("status"),
+        description="Show the depth of a queue folder and the throughput of "
+                    "its workers.")
+    parser.add_argument(
+        "--queue", required=True,
+        help="path to the queue folder")
+    parser.add_argument(
+        "--timeout", type=positive_float, default=300,
+        help="seconds without heartbeat before a worker is stale "
+             "(default: 300)")
+    args = parser.parse_args(args)
+
+    queue = WorkQueue(args.queue, timeout=args.timeout)
+    queue.setup()
+    status = queue.status()
+    for name in ("pending", "claimed", "done", "finished", "failed"):
+        print("{0:<10} {1:>8}".format(name, status[name]))
+
+    print("")
+    print("{0:<32} {1:>8} {2:>9} {3:>6} {4:>10} {5:>10} {6:>8}".format(
+        "worker", "state", "converted", "failed", "wheels/min", "MB/s",
+        "idle (s)"))
+    for stats in status["workers"]:
+        print("{0:<32} {1:>8} {2:>9} {3:>6} {4:>10.2f} {5:>10.2f} "
+              "{6:>8.0f}".format(
+                  stats["worker"], stats["state"], stats["converted"],
+                  stats["failed"], stats["rate"],
+                  stats["throughput"] / 1e6, stats["idle"]))
+    return 0
+
+
+def main_apply(args=None):
+    """Entry point for wheelbin apply."""
+
+    parser = argparse.ArgumentParser(
+        prog=subprogname("apply"),
+        description="Rebuild a compiled wheel from a previous one and a "
+                    "delta file, and check it against its RECORD.")
+    parser.add_argument(
+        "base_whl_file",
+        help="path to the previous compiled wheel")
+    parser.add_argument(
+        "delta_file",
+        help="path to the delta file")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="call the script without printing messages")
+    parser.add_argument(
+        "-o", "--outdir", default=None,
+        help="folder for the rebuilt wheel, which cannot replace the "
+             "previous wheel (default: previous wheel folder)")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of hashing processes (default: number of CPUs)")
+    args = parser.parse_args(args)
+
+    with WheelDelta(args.delta_file, "r") as deltafd:
+        path = deltafd.apply(args.base_whl_file, outdir=args.outdir,
+                             jobs=args.jobs)
+    if not args.quiet:
+        print("Saving: {0}".format(path))
+    return 0
+
+
+COMMANDS = {
+    "verify": main_verify,
+    "benchmark": main_benchmark,
+    "worker": main_worker,
+    "status": main_status,
+    "apply": main_apply,
+}
+
+
+def add_convert_arguments(parser):
+    """Add the conversion options to an argument parser."""
+
+    parser.add_argument(
+        "--exclude", type=str, default=None,
+        help="pattern for files excluded from compilation")
+    parser.add_argument(
+        "-O", "--optimize", type=int, choices=[0, 1, 2], default=-1,
+        help="optimization level of the compiler (default: interpreter one)")
+    parser.add_argument(
+        "--strip-docstrings", action="store_true", default=False,
+        help="remove docstrings from the source code before compiling")
+    parser.add_argument(
+        "--strip-debug", action="store_true", default=False,
+        help="remove `if __debug__` blocks from the source code before "
+             "compiling")
+    parser.add_argument(
+        "--strip", type=strip_profiles, default=[],
+        help="comma-separated profiles of files removed from the output "
+             "wheel ({0})".format(", ".join(sorted(STRIP_PROFILES))))
+    parser.add_argument(
+        "--strip-pattern", action="append", default=[],
+        help="pattern for files removed from the output wheel, matching "
+             "folder names if it ends in '/' and file names if it has no "
+             "'/' (can be repeated)")
+    parser.add_argument(
+        "--verify", action="store_true", default=False,
+        help="check the output wheel against its RECORD after packing")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None,
+        help="number of compilation threads, which only overlap I/O "
+             "(default: up to 4), and of hashing processes for --verify "
+             "(default: number of CPUs)")
+
+
+def convert_options(args):
+    """Return the conversion options from the parsed arguments."""
+
+    return {
+        "optimize": args.optimize,
+        "strip_docstrings": args.strip_docstrings,
+        "strip_debug": args.strip_debug,
+        "verify": args.verify,
+        "jobs": args.jobs,
+        "strip": sum([STRIP_PROFILES[name] for name in args.strip],
+                     args.strip_pattern) or None,
+    }
+
+
+def positive_float(value):
+    """Parse a positive floating-point number."""
+
+    try:
+        number = float(value)
+    except ValueError:
+        number = 0
+    if not number > 0:
+        raise argparse.ArgumentTypeError(
+            "invalid positive number: {0}".format(value))
+    return number
+
+
+def positive_int(value):
+    """Parse a positive integer."""
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "invalid positive integer: {0}".format(value))
+    return number
+
+
+def strip_profiles(value):
+    """Parse a comma-separated list of strip profiles."""
+
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    for name in names:
+        if name not in STRIP_PROFILES:
+            raise argparse.ArgumentTypeError(
+                "unknown strip profile: {0}".format(name))
+    return names
+
+
 def main(args=None):
     """Entry point for wheelbin."""
 
-    parser = argparse.ArgumentParser(prog=progname(), description=__doc__)
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] in COMMANDS:
+        return COMMANDS[args[0]](args[1:])
+
+    parser = argparse.ArgumentParser(
+        prog=progname(), description=__doc__,
+        epilog="other commands: {0} (use --help with any of them)".format(
+            ", ".join(sorted(COMMANDS))))
     parser.add_argument(
         "whl_file",
         help="path to wheel being converted")
@@ -78,11 +446,29 @@ def main(args=None):
         "-q", "--quiet", action="store_true", default=False,
         help="call the script without printing messages")
     parser.add_argument(
-        "--exclude", type=str, default=None,
-        help="pattern for files excluded from compilation")
+        "--stdout", action="store_true", default=False,
+        help="write the output wheel to stdout (messages go to stderr)")
+    parser.add_argument(
+        "--delta-from", default=None,
+        help="previous compiled wheel used to save a delta file next to the "
+             "output wheel")
+    add_convert_arguments(parser)
     args = parser.parse_args(args)
-    convert_wheel(args.whl_file, exclude=args.exclude, verbose=not args.quiet)
+    if args.stdout and args.verify:
+        parser.error("--verify cannot be used together with --stdout")
+    if args.stdout and args.delta_from:
+        parser.error("--delta-from cannot be used together with --stdout")
+    stream = None
+    if args.stdout:
+        stream = getattr(sys.stdout, "buffer", sys.stdout)
+    options = dict(convert_options(args), stream=stream,
+                   delta_from=args.delta_from)
+    convert_wheel(args.whl_file, exclude=args.exclude, verbose=not args.quiet,
+                  options=options)
+    if stream is not None:
+        stream.flush()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())